@@ -13,6 +13,7 @@
 # limitations under the License.
 """Utilities functions KFP DSL."""
 
+import functools
 import re
 from typing import Union
 from kfp.pipeline_spec import pipeline_spec_pb2
@@ -22,11 +23,13 @@ _TASK_NAME_PREFIX = 'task-'
 _EXECUTOR_LABEL_PREFIX = 'exec-'
 
 
+@functools.lru_cache(maxsize=4096)
 def sanitize_component_name(name: str) -> str:
   """Sanitizes component name."""
   return _COMPONENT_NAME_PREFIX + _sanitize_name(name)
 
 
+@functools.lru_cache(maxsize=4096)
 def sanitize_task_name(name: str) -> str:
   """Sanitizes task name."""
   return _TASK_NAME_PREFIX + _sanitize_name(name)
@@ -19,7 +19,9 @@ https://docs.google.com/document/d/1PUDuSQ8vmeKSBloli53mp7GIvzekaY7sggg6ywy35Dk/
 """
 
 import collections
+import functools
 import inspect
+import itertools
 import json
 import uuid
 import warnings
@@ -42,6 +44,12 @@ from google.protobuf import json_format
 
 _GroupOrOp = Union[dsl.OpsGroup, dsl.BaseOp]
 _LOOP_ITERATOR_COMPONENT_NAME_SUFFIX = '-iterator'
+# Resolved once, the enum lookup goes through the proto descriptor.
+_STRING_PARAMETER_TYPE = pipeline_spec_pb2.PrimitiveType.STRING
+_METRICS_SCHEMA_TITLES = frozenset([
+    io_types.Metrics.TYPE_NAME,
+    io_types.ClassificationMetrics.TYPE_NAME,
+])
 
 
 class Compiler(object):
@@ -67,8 +75,8 @@ class Compiler(object):
       kfp.v2.compiler.Compiler().compile(my_pipeline, 'path/to/pipeline.json')
   """
 
-  def _get_groups_for_ops(self,
-                          root_group: dsl.OpsGroup) -> Dict[str, List[str]]:
+  def _get_groups_for_ops(
+      self, root_group: dsl.OpsGroup) -> Dict[str, Tuple[str, ...]]:
     """Helper function to get groups that contain the specified ops.
 
     Each pipeline has a root group. Each group has a list of operators (leaf)
@@ -80,35 +88,31 @@ class Compiler(object):
      root_group: The root node of a ops tree or subtree.
 
     Returns:
-      A dict. Key is the operator's name. Value is a list of ancestor groups
+      A dict. Key is the operator's name. Value is a tuple of ancestor groups
       including the op itself. The list of a given operator is sorted in a way
       that the farthest group is the first and operator itself is the last.
     """
 
-    def _get_op_groups_helper(
-        current_groups: List[dsl.OpsGroup],
-        ops_to_groups: Dict[str, List[dsl.OpsGroup]]) -> None:
-      root_group = current_groups[-1]
-      for g in root_group.groups:
+    ops_to_groups = {}
+    # Iterative DFS, each entry carries the names of the group's ancestors
+    # including the group itself.
+    stack = [(root_group, (root_group.name,))]
+    while stack:
+      group, group_names = stack.pop()
+      for g in reversed(group.groups):
         # Add recursive opsgroup in the ops_to_groups
         # such that the i/o dependency can be propagated to the ancester opsgroups
         if g.recursive_ref:
-          ops_to_groups[g.name] = [x.name for x in current_groups] + [g.name]
+          ops_to_groups[g.name] = group_names + (g.name,)
           continue
-        current_groups.append(g)
-        _get_op_groups_helper(current_groups, ops_to_groups)
-        del current_groups[-1]
-      for op in root_group.ops:
-        ops_to_groups[op.name] = [x.name for x in current_groups] + [op.name]
-
-    ops_to_groups = {}
-    current_groups = [root_group]
-    _get_op_groups_helper(current_groups, ops_to_groups)
+        stack.append((g, group_names + (g.name,)))
+      for op in group.ops:
+        ops_to_groups[op.name] = group_names + (op.name,)
     return ops_to_groups
 
   #TODO: combine with the _get_groups_for_ops
   def _get_groups_for_opsgroups(
-      self, root_group: dsl.OpsGroup) -> Dict[str, List[str]]:
+      self, root_group: dsl.OpsGroup) -> Dict[str, Tuple[str, ...]]:
     """Helper function to get groups that contain the specified opsgroup.
 
     Each pipeline has a root group. Each group has a list of operators (leaf)
@@ -120,120 +124,162 @@ class Compiler(object):
      root_group: The root node of a groups tree or subtree.
 
     Returns:
-      A dict. Key is the opsgroup's name. Value is a list of ancestor groups
+      A dict. Key is the opsgroup's name. Value is a tuple of ancestor groups
       including the opsgroup itself. The list of a given opsgroup is sorted in a
       way that the farthest group is the first and opsgroup itself is the last.
     """
 
-    def _get_opsgroup_groups_helper(
-        current_groups: dsl.OpsGroup,
-        opsgroups_to_groups: Dict[str, List[dsl.OpsGroup]]) -> None:
-      root_group = current_groups[-1]
-      for g in root_group.groups:
-        # Add recursive opsgroup in the ops_to_groups
-        # such that the i/o dependency can be propagated to the ancester opsgroups
-        if g.recursive_ref:
-          continue
-        opsgroups_to_groups[g.name] = [x.name for x in current_groups
-                                      ] + [g.name]
-        current_groups.append(g)
-        _get_opsgroup_groups_helper(current_groups, opsgroups_to_groups)
-        del current_groups[-1]
-
     opsgroups_to_groups = {}
-    current_groups = [root_group]
-    _get_opsgroup_groups_helper(current_groups, opsgroups_to_groups)
+    # Iterative preorder DFS, each entry carries the names of the group's
+    # ancestors including the group itself.
+    stack = [(root_group, (root_group.name,))]
+    while stack:
+      group, group_names = stack.pop()
+      if group is not root_group:
+        opsgroups_to_groups[group.name] = group_names
+      for g in reversed(group.groups):
+        # Skip the recursive opsgroups, they are not real groups.
+        if not g.recursive_ref:
+          stack.append((g, group_names + (g.name,)))
     return opsgroups_to_groups
 
   def _get_groups(self, root_group: dsl.OpsGroup) -> Dict[str, dsl.OpsGroup]:
     """Helper function to get all groups (not including ops) in a pipeline."""
 
-    def _get_groups_helper(group):
-      groups = {group.name: group}
-      for g in group.groups:
+    groups = {}
+    # Iterative preorder DFS, children are pushed in reverse so that they are
+    # visited in their original order.
+    stack = [root_group]
+    while stack:
+      group = stack.pop()
+      groups[group.name] = group
+      for g in reversed(group.groups):
         # Skip the recursive opsgroup because no templates
         # need to be generated for the recursive opsgroups.
         if not g.recursive_ref:
-          groups.update(_get_groups_helper(g))
-      return groups
+          stack.append(g)
+    return groups
 
-    return _get_groups_helper(root_group)
+  def _get_name_to_groups(
+      self,
+      op_groups: Dict[str, Tuple[str, ...]],
+      opsgroup_groups: Dict[str, Tuple[str, ...]],
+  ) -> Dict[str, Tuple[str, ...]]:
+    """Merges the ancestor groups of ops and opsgroups into a single dict.
+
+    Ops take precedence over opsgroups of the same name.
+    """
+    name_to_groups = dict(opsgroup_groups)
+    name_to_groups.update(op_groups)
+    return name_to_groups
 
   def _get_uncommon_ancestors(
       self,
-      op_groups: Dict[str, List[str]],
-      opsgroup_groups: Dict[str, List[str]],
-      op1: dsl.BaseOp,
-      op2: dsl.BaseOp,
-  ) -> Tuple[List[_GroupOrOp], List[_GroupOrOp]]:
+      name_to_groups: Dict[str, Tuple[str, ...]],
+      common_ancestors_len_cache: Dict[Tuple[str, str], int],
+      op1: _GroupOrOp,
+      op2: _GroupOrOp,
+  ) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
     """Helper function to get unique ancestors between two ops.
 
     For example, op1's ancestor groups are [root, G1, G2, G3, op1], op2's
     ancestor groups are
     [root, G1, G4, op2], then it returns a tuple ([G2, G3, op1], [G4, op2]).
+
+    Args:
+      name_to_groups: The dict of op/opsgroup name to parent groups, as built
+        by _get_name_to_groups.
+      common_ancestors_len_cache: The common ancestor chain length of already
+        compared pairs, keyed by (name1, name2) with name1 <= name2. Updated in
+        place, it must only be shared within the compilation of one pipeline.
+      op1: The first op or opsgroup.
+      op2: The second op or opsgroup.
     """
-    #TODO: extract a function for the following two code module
-    if op1.name in op_groups:
-      op1_groups = op_groups[op1.name]
-    elif op1.name in opsgroup_groups:
-      op1_groups = opsgroup_groups[op1.name]
-    else:
+    try:
+      op1_groups = name_to_groups[op1.name]
+    except KeyError:
       raise ValueError(op1.name + ' does not exist.')
+    try:
+      op2_groups = name_to_groups[op2.name]
+    except KeyError:
+      raise ValueError(op2.name + ' does not exist.')
 
-    if op2.name in op_groups:
-      op2_groups = op_groups[op2.name]
-    elif op2.name in opsgroup_groups:
-      op2_groups = opsgroup_groups[op2.name]
+    if op1.name < op2.name:
+      cache_key = (op1.name, op2.name)
     else:
-      raise ValueError(op2.name + ' does not exist.')
+      cache_key = (op2.name, op1.name)
+    common_groups_len = common_ancestors_len_cache.get(cache_key)
+    if common_groups_len is None:
+      common_groups_len = 0
+      # Both chains are built from the same group objects, so the names of
+      # common ancestors are usually the very same string objects.
+      for group1_name, group2_name in zip(op1_groups, op2_groups):
+        if group1_name is not group2_name and group1_name != group2_name:
+          break
+        common_groups_len += 1
+      common_ancestors_len_cache[cache_key] = common_groups_len
 
-    both_groups = [op1_groups, op2_groups]
-    common_groups_len = sum(
-        1 for x in zip(*both_groups) if x == (x[0],) * len(x))
     group1 = op1_groups[common_groups_len:]
     group2 = op2_groups[common_groups_len:]
     return (group1, group2)
 
+  def _has_group_of_type(self, root_group: dsl.OpsGroup,
+                         group_type: str) -> bool:
+    """Checks whether the group tree contains a group of the given type."""
+    stack = [root_group]
+    while stack:
+      group = stack.pop()
+      if group.type == group_type:
+        return True
+      stack.extend(group.groups)
+    return False
+
   def _get_condition_params_for_ops(
       self, root_group: dsl.OpsGroup) -> Dict[str, dsl.PipelineParam]:
     """Get parameters referenced in conditions of ops."""
     conditions = collections.defaultdict(set)
 
-    def _get_condition_params_for_ops_helper(group, current_conditions_params):
+    # Most pipelines have no dsl.Condition, no need to visit their ops.
+    if not self._has_group_of_type(root_group, 'condition'):
+      return conditions
+
+    # Iterative DFS, each entry carries the condition params of the enclosing
+    # condition groups, as a tuple shared by all the groups they enclose.
+    stack = [(root_group, ())]
+    while stack:
+      group, current_conditions_params = stack.pop()
       new_current_conditions_params = current_conditions_params
       if group.type == 'condition':
-        new_current_conditions_params = list(current_conditions_params)
-        if isinstance(group.condition.operand1, dsl.PipelineParam):
-          new_current_conditions_params.append(group.condition.operand1)
-        if isinstance(group.condition.operand2, dsl.PipelineParam):
-          new_current_conditions_params.append(group.condition.operand2)
-      for op in group.ops:
-        for param in new_current_conditions_params:
-          conditions[op.name].add(param)
-      for g in group.groups:
+        new_current_conditions_params += tuple(
+            operand
+            for operand in (group.condition.operand1, group.condition.operand2)
+            if isinstance(operand, dsl.PipelineParam))
+      if new_current_conditions_params:
+        for op in group.ops:
+          conditions[op.name].update(new_current_conditions_params)
+      for g in reversed(group.groups):
         # If the subgroup is a recursive opsgroup, propagate the pipelineparams
         # in the condition expression, similar to the ops.
         if g.recursive_ref:
-          for param in new_current_conditions_params:
-            conditions[g.name].add(param)
+          if new_current_conditions_params:
+            conditions[g.name].update(new_current_conditions_params)
         else:
-          _get_condition_params_for_ops_helper(g, new_current_conditions_params)
-
-    _get_condition_params_for_ops_helper(root_group, [])
+          stack.append((g, new_current_conditions_params))
     return conditions
 
-  def _get_next_group_or_op(self, to_visit: List, already_visited: Set):
+  def _get_next_group_or_op(self, to_visit: collections.deque,
+                            already_visited: Set):
     """Get next group or op to visit."""
     if len(to_visit) == 0:
       return None
-    next = to_visit.pop(0)
+    next = to_visit.popleft()
     while next in already_visited:
-      next = to_visit.pop(0)
+      next = to_visit.popleft()
     already_visited.add(next)
     return next
 
   def _get_for_loop_ops(self, new_root) -> Dict[str, dsl.ParallelFor]:
-    to_visit = self._get_all_subgroups_and_ops(new_root)
+    to_visit = collections.deque(self._get_all_subgroups_and_ops(new_root))
     op_name_to_op = {}
     already_visited = set()
 
@@ -249,20 +295,18 @@ class Compiler(object):
 
   def _get_all_subgroups_and_ops(self, group: dsl.OpsGroup):
     """Get all ops and groups contained within this group."""
-    subgroups = []
-    if hasattr(group, 'ops'):
-      subgroups.extend(group.ops)
-    if hasattr(group, 'groups'):
-      subgroups.extend(group.groups)
-    return subgroups
+    # Ops are leaves without either attribute.
+    return [*getattr(group, 'ops', ()), *getattr(group, 'groups', ())]
 
   def _get_inputs_outputs(
       self,
       pipeline: dsl.Pipeline,
       args: List[dsl.PipelineParam],
       root_group: dsl.OpsGroup,
-      op_groups: Dict[str, List[str]],
-      opsgroup_groups: Dict[str, List[str]],
+      op_groups: Dict[str, Tuple[str, ...]],
+      opsgroup_groups: Dict[str, Tuple[str, ...]],
+      name_to_groups: Dict[str, Tuple[str, ...]],
+      common_ancestors_len_cache: Dict[Tuple[str, str], int],
       condition_params: Dict[str, dsl.PipelineParam],
       op_name_to_for_loop_op: Dict[str, dsl.ParallelFor],
   ) -> Tuple[Dict[str, List[Tuple[dsl.PipelineParam, str]]], Dict[
@@ -275,6 +319,9 @@ class Compiler(object):
       root_group: The root OpsGroup.
       op_groups: The dict of op name to parent groups.
       opsgroup_groups: The dict of opsgroup name to parent groups.
+      name_to_groups: The dict of op/opsgroup name to parent groups, as built
+        by _get_name_to_groups.
+      common_ancestors_len_cache: The cache passed to _get_uncommon_ancestors.
       condition_params: The dict of group name to pipeline params referenced in
         the conditions in that group.
       op_name_to_for_loop_op: The dict of op name to loop ops.
@@ -292,21 +339,25 @@ class Compiler(object):
     # Fix possible missing type -- PipelineParam parsed from command line args
     # doesn't contain the type information, as the `.param_type` is not included
     # during PipelineParam serialization.
+    ops = list(pipeline.ops.values())
     all_params = {param.pattern: param for param in args}
-    for op in pipeline.ops.values():
-      for param in op.inputs + list(op.outputs.values()) + list(
-          condition_params[op.name]):
-        if param.pattern not in all_params:
-          all_params[param.pattern] = param
-        else:
-          param.param_type = param.param_type or all_params[
-              param.pattern].param_type
-          all_params[param.pattern].param_type = param.param_type
+    for op in ops:
+      for param in itertools.chain(op.inputs, op.outputs.values(),
+                                   condition_params.get(op.name, ())):
+        pattern = param.pattern
+        known_param = all_params.get(pattern)
+        if known_param is None:
+          all_params[pattern] = param
+        elif known_param is not param:
+          param_type = param.param_type or known_param.param_type
+          param.param_type = param_type
+          known_param.param_type = param_type
 
-    for op in pipeline.ops.values():
+    for op in ops:
       # op's inputs and all params used in conditions for that op are both
       # considered.
-      for param in op.inputs + list(condition_params[op.name]):
+      for param in itertools.chain(op.inputs,
+                                   condition_params.get(op.name, ())):
 
         # if the value is already provided (immediate value), then no need to
         # expose it as input for its parent groups.
@@ -314,9 +365,8 @@ class Compiler(object):
           continue
         if param.op_name:
           upstream_op = pipeline.ops[param.op_name]
-          upstream_groups, downstream_groups = (
-              self._get_uncommon_ancestors(op_groups, opsgroup_groups,
-                                           upstream_op, op))
+          upstream_groups, downstream_groups = self._get_uncommon_ancestors(
+              name_to_groups, common_ancestors_len_cache, upstream_op, op)
           for i, group_name in enumerate(downstream_groups):
             if i == 0:
               # If it is the first uncommon downstream group, then the input
@@ -335,7 +385,7 @@ class Compiler(object):
               outputs[group_name].add((param, upstream_groups[i + 1]))
         else:
           if not op.is_exit_handler:
-            for group_name in op_groups[op.name][::-1]:
+            for group_name in reversed(op_groups[op.name]):
               # if group is for loop group and param is that loop's param, then the param
               # is created by that for loop ops_group and it shouldn't be an input to
               # any of its parent groups.
@@ -350,7 +400,10 @@ class Compiler(object):
 
     # Generate the input/output for recursive opsgroups
     # It propagates the recursive opsgroups IO to their ancester opsgroups
-    def _get_inputs_outputs_recursive_opsgroup(group: dsl.OpsGroup):
+    # Iterative preorder DFS over all the groups.
+    stack = [root_group]
+    while stack:
+      group = stack.pop()
       #TODO: refactor the following codes with the above
       if group.recursive_ref:
         params = [(param, False) for param in group.inputs]
@@ -364,7 +417,9 @@ class Compiler(object):
           if param.op_name:
             upstream_op = pipeline.ops[param.op_name]
             upstream_groups, downstream_groups = \
-              self._get_uncommon_ancestors(op_groups, opsgroup_groups, upstream_op, group)
+              self._get_uncommon_ancestors(name_to_groups,
+                                           common_ancestors_len_cache,
+                                           upstream_op, group)
             for i, g in enumerate(downstream_groups):
               if i == 0:
                 inputs[g].add((param, upstream_groups[0]))
@@ -382,23 +437,21 @@ class Compiler(object):
           elif not is_condition_param:
             for g in op_groups[group.name]:
               inputs[g].add((param, None))
-      for subgroup in group.groups:
-        _get_inputs_outputs_recursive_opsgroup(subgroup)
-
-    _get_inputs_outputs_recursive_opsgroup(root_group)
+      stack.extend(reversed(group.groups))
 
     # Generate the input for SubGraph along with parallelfor
-    for subgraph in opsgroup_groups:
-      if subgraph in op_name_to_for_loop_op:
-        # The opsgroup list is sorted with the farthest group as the first and the opsgroup
-        # itself as the last. To get the latest opsgroup which is not the opsgroup itself -2 is used.
-        parent = opsgroup_groups[subgraph][-2]
-        if parent and parent.startswith('subgraph'):
-          # propagate only op's pipeline param from subgraph to parallelfor
-          loop_op = op_name_to_for_loop_op[subgraph]
-          pipeline_param = loop_op.loop_args.items_or_pipeline_param
-          if loop_op.items_is_pipeline_param and pipeline_param.op_name:
-            inputs[parent].add((pipeline_param, pipeline_param.op_name))
+    for subgraph, subgraph_groups in opsgroup_groups.items():
+      loop_op = op_name_to_for_loop_op.get(subgraph)
+      if loop_op is None:
+        continue
+      # The opsgroup list is sorted with the farthest group as the first and the opsgroup
+      # itself as the last. To get the latest opsgroup which is not the opsgroup itself -2 is used.
+      parent = subgraph_groups[-2]
+      if parent and parent.startswith('subgraph'):
+        # propagate only op's pipeline param from subgraph to parallelfor
+        pipeline_param = loop_op.loop_args.items_or_pipeline_param
+        if loop_op.items_is_pipeline_param and pipeline_param.op_name:
+          inputs[parent].add((pipeline_param, pipeline_param.op_name))
 
     return inputs, outputs
 
@@ -406,78 +459,86 @@ class Compiler(object):
       self,
       pipeline: dsl.Pipeline,
       root_group: dsl.OpsGroup,
-      op_groups: Dict[str, List[str]],
-      opsgroups_groups: Dict[str, List[str]],
+      name_to_groups: Dict[str, Tuple[str, ...]],
+      common_ancestors_len_cache: Dict[Tuple[str, str], int],
       opsgroups: Dict[str, dsl.OpsGroup],
       condition_params: Dict[str, dsl.PipelineParam],
-  ) -> Dict[str, List[_GroupOrOp]]:
+  ) -> Dict[str, List[str]]:
     """Get dependent groups and ops for all ops and groups.
 
     Args:
       pipeline: The instantiated pipeline object.
       root_group: The root OpsGroup.
-      op_groups: The dict of op name to parent groups.
-      opsgroup_groups: The dict of opsgroup name to parent groups.
+      name_to_groups: The dict of op/opsgroup name to parent groups, as built
+        by _get_name_to_groups.
+      common_ancestors_len_cache: The cache passed to _get_uncommon_ancestors.
       opsgroups: The dict of opsgroup name to opsgroup.
       condition_params: The dict of group name to pipeline params referenced in
         the conditions in that group.
 
     Returns:
-      A dict. Key is group/op name, value is a list of dependent groups/ops.
+      A dict. Key is group/op name, value is a list of the names of dependent
+      groups/ops, without duplicates.
       The dependencies are calculated in the following way: if op2 depends on
       op1, and their ancestors are [root, G1, G2, op1] and
       [root, G1, G3, G4, op2], then G3 is dependent on G2. Basically dependency
       only exists in the first uncommon ancesters in their ancesters chain. Only
       sibling groups/ops can have dependencies.
     """
-    dependencies = collections.defaultdict(set)
+    pipeline_ops = pipeline.ops
+
+    def _get_op_or_opsgroup(name: str) -> _GroupOrOp:
+      # the dependent op could be either a BaseOp or an opsgroup
+      upstream_op = pipeline_ops.get(name)
+      if upstream_op is None:
+        upstream_op = opsgroups.get(name)
+        if upstream_op is None:
+          raise ValueError('compiler cannot find the ' + name)
+      return upstream_op
+
+    # Dependencies are kept as lists, deduplicated through a parallel set of
+    # the names already recorded for each downstream group/op.
+    dependencies = collections.defaultdict(list)
+    recorded_dependencies = collections.defaultdict(set)
+
+    def _add_dependency(downstream_name: str, upstream_name: str) -> None:
+      recorded = recorded_dependencies[downstream_name]
+      if upstream_name not in recorded:
+        recorded.add(upstream_name)
+        dependencies[downstream_name].append(upstream_name)
+
     for op in pipeline.ops.values():
       upstream_op_names = set()
       for param in op.inputs + list(condition_params[op.name]):
         if param.op_name:
           upstream_op_names.add(param.op_name)
-      upstream_op_names |= set(op.dependent_names)
+      upstream_op_names.update(op.dependent_names)
 
       for upstream_op_name in upstream_op_names:
-        # the dependent op could be either a BaseOp or an opsgroup
-        if upstream_op_name in pipeline.ops:
-          upstream_op = pipeline.ops[upstream_op_name]
-        elif upstream_op_name in opsgroups:
-          upstream_op = opsgroups[upstream_op_name]
-        else:
-          raise ValueError('compiler cannot find the ' + upstream_op_name)
-
+        upstream_op = _get_op_or_opsgroup(upstream_op_name)
         upstream_groups, downstream_groups = self._get_uncommon_ancestors(
-            op_groups, opsgroups_groups, upstream_op, op)
-        dependencies[downstream_groups[0]].add(upstream_groups[0])
+            name_to_groups, common_ancestors_len_cache, upstream_op, op)
+        _add_dependency(downstream_groups[0], upstream_groups[0])
 
     # Generate dependencies based on the recursive opsgroups
     #TODO: refactor the following codes with the above
-    def _get_dependency_opsgroup(
-        group: dsl.OpsGroup, dependencies: Dict[str, List[_GroupOrOp]]) -> None:
-      upstream_op_names = set(
-          [dependency.name for dependency in group.dependencies])
+    # Iterative preorder DFS over all the groups.
+    stack = [root_group]
+    while stack:
+      group = stack.pop()
+      upstream_op_names = {dependency.name for dependency in group.dependencies}
       if group.recursive_ref:
         for param in group.inputs + list(condition_params[group.name]):
           if param.op_name:
             upstream_op_names.add(param.op_name)
 
       for op_name in upstream_op_names:
-        if op_name in pipeline.ops:
-          upstream_op = pipeline.ops[op_name]
-        elif op_name in opsgroups:
-          upstream_op = opsgroups[op_name]
-        else:
-          raise ValueError('compiler cannot find the ' + op_name)
-        upstream_groups, downstream_groups = (
-            self._get_uncommon_ancestors(op_groups, opsgroups_groups,
-                                         upstream_op, group))
-        dependencies[downstream_groups[0]].add(upstream_groups[0])
-
-      for subgroup in group.groups:
-        _get_dependency_opsgroup(subgroup, dependencies)
+        upstream_op = _get_op_or_opsgroup(op_name)
+        upstream_groups, downstream_groups = self._get_uncommon_ancestors(
+            name_to_groups, common_ancestors_len_cache, upstream_op, group)
+        _add_dependency(downstream_groups[0], upstream_groups[0])
 
-    _get_dependency_opsgroup(root_group, dependencies)
+      stack.extend(reversed(group.groups))
 
     return dependencies
 
@@ -543,7 +604,11 @@ class Compiler(object):
     # Insert an intermediate component.
     loop_iterator_component_base_name = (
         subgroup.name + _LOOP_ITERATOR_COMPONENT_NAME_SUFFIX)
-    loop_iterator_component_spec = pipeline_spec_pb2.ComponentSpec()
+    loop_iterator_component_name = dsl_utils.sanitize_component_name(
+        loop_iterator_component_base_name)
+    # Build the component spec in place, the map access inserts it.
+    loop_iterator_component_spec = pipeline_spec.components[
+        loop_iterator_component_name]
     loop_iterator_component_spec.input_definitions.CopyFrom(
         subgroup_component_spec.input_definitions)
 
@@ -555,19 +620,16 @@ class Compiler(object):
       dsl_component_spec.pop_input_from_component_spec(
           loop_iterator_component_spec, input_parameter_name)
       loop_iterator_component_spec.input_definitions.parameters[
-          loop_argument_base_name].type = pipeline_spec_pb2.PrimitiveType.STRING
+          loop_argument_base_name].type = _STRING_PARAMETER_TYPE
     else:
       loop_iterator_component_spec.input_definitions.parameters[
-          input_parameter_name].type = pipeline_spec_pb2.PrimitiveType.STRING
-
-    loop_iterator_component_name = dsl_utils.sanitize_component_name(
-        loop_iterator_component_base_name)
-    pipeline_spec.components[loop_iterator_component_name].CopyFrom(
-        loop_iterator_component_spec)
+          input_parameter_name].type = _STRING_PARAMETER_TYPE
 
     loop_iterator_task_name = dsl_utils.sanitize_task_name(
         loop_iterator_component_base_name)
-    loop_iterator_task_spec = pipeline_spec_pb2.PipelineTaskSpec()
+    # Add task spec
+    loop_iterator_task_spec = subgroup_component_spec.dag.tasks[
+        loop_iterator_task_name]
     loop_iterator_task_spec.task_info.name = loop_iterator_task_name
     loop_iterator_task_spec.component_ref.name = loop_iterator_component_name
     if subgroup.items_is_pipeline_param:
@@ -591,10 +653,6 @@ class Compiler(object):
       loop_iterator_task_spec.inputs.parameters[
           input_name].component_input_parameter = input_name
 
-    # Add task spec
-    subgroup_component_spec.dag.tasks[loop_iterator_task_name].CopyFrom(
-        loop_iterator_task_spec)
-
   def _update_loop_subgroup_specs(
       self,
       group: dsl.OpsGroup,
@@ -612,21 +670,31 @@ class Compiler(object):
       subgroup_component_spec: The component spec of the subgroup to update.
       subgroup_task_spec: The task spec of the subgroup to update.
     """
+    # The loop argument input names only depend on the loop group, compute
+    # them once rather than for every input of the subgroup.
+    withitems_input_name = (
+        dsl_component_spec.additional_input_name_for_pipelineparam(
+            group.loop_args.full_name))
+    withparams_input_name = None
+    if group.items_is_pipeline_param:
+      withparams_input_name = (
+          dsl_component_spec.additional_input_name_for_pipelineparam(
+              '{}-{}'.format(group.loop_args.items_or_pipeline_param.full_name,
+                             _for_loop.LoopArguments.LOOP_ITEM_NAME_BASE)))
+
     input_names = [
         input_name for input_name in subgroup_task_spec.inputs.parameters
     ]
     for input_name in input_names:
+      input_parameter_spec = subgroup_task_spec.inputs.parameters[input_name]
 
-      if subgroup_task_spec.inputs.parameters[input_name].HasField(
-          'component_input_parameter'):
-        loop_argument_name = subgroup_task_spec.inputs.parameters[
-            input_name].component_input_parameter
+      if input_parameter_spec.HasField('component_input_parameter'):
+        loop_argument_name = input_parameter_spec.component_input_parameter
       else:
         producer_task_name = dsl_utils.remove_task_name_prefix(
-            subgroup_task_spec.inputs.parameters[input_name]
-            .task_output_parameter.producer_task)
-        producer_task_output_key = subgroup_task_spec.inputs.parameters[
-            input_name].task_output_parameter.output_parameter_key
+            input_parameter_spec.task_output_parameter.producer_task)
+        producer_task_output_key = (
+            input_parameter_spec.task_output_parameter.output_parameter_key)
         loop_argument_name = '{}-{}'.format(producer_task_name,
                                             producer_task_output_key)
 
@@ -635,43 +703,26 @@ class Compiler(object):
           loop_argument_name):
 
         assert group.items_is_pipeline_param
-        pipeline_param = group.loop_args.items_or_pipeline_param
-        input_parameter_name = (
-            dsl_component_spec.additional_input_name_for_pipelineparam(
-                pipeline_param))
-
-        loop_argument_base_name = '{}-{}'.format(
-            pipeline_param.full_name,
-            _for_loop.LoopArguments.LOOP_ITEM_NAME_BASE)
-        subgroup_task_spec.inputs.parameters[
-            input_name].component_input_parameter = (
-                dsl_component_spec.additional_input_name_for_pipelineparam(
-                    loop_argument_base_name))
+        input_parameter_spec.component_input_parameter = withparams_input_name
 
       # Loop arguments come from static raw values known at compile time.
       elif _for_loop.LoopArguments.name_is_withitems_loop_argument(
           loop_argument_name):
 
-        pipeline_param_name = group.loop_args.full_name
-
-        subgroup_task_spec.inputs.parameters[
-            input_name].component_input_parameter = (
-                dsl_component_spec.additional_input_name_for_pipelineparam(
-                    pipeline_param_name))
+        input_parameter_spec.component_input_parameter = withitems_input_name
 
       # Loop arguments contain subvar referencing.
       if _for_loop.LoopArgumentVariable.name_is_loop_arguments_variable(
           loop_argument_name):
         subvar_name = _for_loop.LoopArgumentVariable.get_subvar_name(
             loop_argument_name)
-        subgroup_task_spec.inputs.parameters[
-            input_name].parameter_expression_selector = (
-                'parseJson(string_value)["{}"]'.format(subvar_name))
+        input_parameter_spec.parameter_expression_selector = (
+            'parseJson(string_value)["{}"]'.format(subvar_name))
 
   def _populate_metrics_in_dag_outputs(
       self,
       ops: List[dsl.ContainerOp],
-      op_to_parent_groups: Dict[str, List[str]],
+      op_to_parent_groups: Dict[str, Tuple[str, ...]],
       pipeline_spec: pipeline_spec_pb2.PipelineSpec,
   ) -> None:
     """Populates metrics artifacts in dag outputs.
@@ -679,7 +730,7 @@ class Compiler(object):
     Args:
       ops: The list of ops that may produce metrics outputs.
       op_to_parent_groups: The dict of op name to parent groups. Key is the op's
-        name. Value is a list of ancestor groups including the op itself. The
+        name. Value is a tuple of ancestor groups including the op itself. The
         list of a given op is sorted in a way that the farthest group is the
         first and the op itself is the last.
       pipeline_spec: The pipeline_spec to update in-place.
@@ -690,48 +741,48 @@ class Compiler(object):
       op_component_spec = getattr(op, 'component_spec',
                                   pipeline_spec_pb2.ComponentSpec())
 
-      # Get the component spec for all its parent groups.
-      parent_groups_component_specs = [pipeline_spec.root]
-      # skip the op itself and the root group which cannot be retrived via name.
-      for group_name in op_to_parent_groups[op.name][1:-1]:
-        component_name = dsl_utils.sanitize_component_name(group_name)
-        parent_groups_component_specs.append(
-            pipeline_spec.components[component_name])
-      # Reverse the order to make the farthest group in the end.
-      parent_groups_component_specs.reverse()
-
+      op_task_name = op_task_spec.task_info.name
+      # Collect the metrics outputs of the op into a single patch, merged into
+      # each parent group below.
+      metrics_outputs_patch = pipeline_spec_pb2.ComponentSpec()
       for output_name, artifact_spec in \
           op_component_spec.output_definitions.artifacts.items():
 
         if artifact_spec.artifact_type.WhichOneof(
             'kind'
-        ) == 'schema_title' and artifact_spec.artifact_type.schema_title in [
-            io_types.Metrics.TYPE_NAME,
-            io_types.ClassificationMetrics.TYPE_NAME,
-        ]:
-          unique_output_name = '{}-{}'.format(op_task_spec.task_info.name,
-                                              output_name)
-
-          for group_component_spec in parent_groups_component_specs:
-            group_component_spec.output_definitions.artifacts[
-                unique_output_name].CopyFrom(artifact_spec)
-            group_component_spec.dag.outputs.artifacts[
-                unique_output_name].artifact_selectors.append(
-                    pipeline_spec_pb2.DagOutputsSpec.ArtifactSelectorSpec(
-                        producer_subtask=op_task_spec.task_info.name,
-                        output_artifact_key=output_name,
-                    ))
+        ) == 'schema_title' and (artifact_spec.artifact_type.schema_title
+                                 in _METRICS_SCHEMA_TITLES):
+          unique_output_name = '{}-{}'.format(op_task_name, output_name)
+
+          metrics_outputs_patch.output_definitions.artifacts[
+              unique_output_name].CopyFrom(artifact_spec)
+          metrics_outputs_patch.dag.outputs.artifacts[
+              unique_output_name].artifact_selectors.append(
+                  pipeline_spec_pb2.DagOutputsSpec.ArtifactSelectorSpec(
+                      producer_subtask=op_task_name,
+                      output_artifact_key=output_name,
+                  ))
+
+      if not metrics_outputs_patch.output_definitions.artifacts:
+        continue
+
+      # Merge into all its parent groups. Skip the op itself and the root group
+      # which cannot be retrived via name.
+      pipeline_spec.root.MergeFrom(metrics_outputs_patch)
+      for group_name in op_to_parent_groups[op.name][1:-1]:
+        component_name = dsl_utils.sanitize_component_name(group_name)
+        pipeline_spec.components[component_name].MergeFrom(
+            metrics_outputs_patch)
 
   def _group_to_dag_spec(
       self,
       group: dsl.OpsGroup,
       inputs: Dict[str, List[Tuple[dsl.PipelineParam, str]]],
       outputs: Dict[str, List[Tuple[dsl.PipelineParam, str]]],
-      dependencies: Dict[str, List[_GroupOrOp]],
+      dependencies: Dict[str, List[str]],
       pipeline_spec: pipeline_spec_pb2.PipelineSpec,
       deployment_config: pipeline_spec_pb2.PipelineDeploymentConfig,
       rootgroup_name: str,
-      op_to_parent_groups: Dict[str, List[str]],
   ) -> None:
     """Generate IR spec given an OpsGroup.
 
@@ -747,10 +798,6 @@ class Compiler(object):
       deployment_config: The deployment_config to hold all executors.
       rootgroup_name: The name of the group root. Used to determine whether the
         component spec for the current group should be the root dag.
-      op_to_parent_groups: The dict of op name to parent groups. Key is the op's
-        name. Value is a list of ancestor groups including the op itself. The
-        list of a given op is sorted in a way that the farthest group is the
-        first and the op itself is the last.
     """
     group_component_name = dsl_utils.sanitize_component_name(group.name)
 
@@ -759,17 +806,44 @@ class Compiler(object):
     else:
       group_component_spec = pipeline_spec.components[group_component_name]
 
+    is_loop_subgroup = isinstance(group, dsl.ParallelFor)
+    if is_loop_subgroup:
+      # Retrieve the real parent component, which is the compiler injected
+      # loop iterator component.
+      loop_iterator_component_name = dsl_utils.sanitize_component_name(
+          group.name + _LOOP_ITERATOR_COMPONENT_NAME_SUFFIX)
+      group_component_spec = pipeline_spec.components[
+          loop_iterator_component_name]
+
+    # Proto submessage wrappers are cached, identity is enough here and avoids
+    # a full message comparison.
+    is_parent_component_root = group_component_spec is pipeline_spec.root
+
+    input_parameters_in_current_dag = list(
+        group_component_spec.input_definitions.parameters)
+    input_artifacts_in_current_dag = list(
+        group_component_spec.input_definitions.artifacts)
+
     # Generate task specs and component specs for the dag.
-    subgroups = group.groups + group.ops
+    subgroups = (*group.groups, *group.ops)
+    tasks_in_current_dag = [
+        dsl_utils.sanitize_task_name(subgroup.name) for subgroup in subgroups
+    ]
     for subgroup in subgroups:
-      subgroup_task_spec = getattr(subgroup, 'task_spec',
-                                   pipeline_spec_pb2.PipelineTaskSpec())
-      subgroup_component_spec = getattr(subgroup, 'component_spec',
-                                        pipeline_spec_pb2.ComponentSpec())
-
-      is_loop_subgroup = (isinstance(group, dsl.ParallelFor))
+      # Only groups lack specs, avoid building throwaway defaults for ops.
+      subgroup_task_spec = getattr(subgroup, 'task_spec', None)
+      if subgroup_task_spec is None:
+        subgroup_task_spec = pipeline_spec_pb2.PipelineTaskSpec()
+      subgroup_component_spec = getattr(subgroup, 'component_spec', None)
+      if subgroup_component_spec is None:
+        subgroup_component_spec = pipeline_spec_pb2.ComponentSpec()
+
+      # Classify the subgroup once, the checks below only read these.
+      is_container_op = isinstance(subgroup, dsl.ContainerOp)
+      opsgroup_type = (
+          subgroup.type if isinstance(subgroup, dsl.OpsGroup) else None)
       is_recursive_subgroup = (
-          isinstance(subgroup, dsl.OpsGroup) and subgroup.recursive_ref)
+          opsgroup_type is not None and subgroup.recursive_ref)
 
       # Special handling for recursive subgroup: use the existing opsgroup name
       if is_recursive_subgroup:
@@ -777,9 +851,10 @@ class Compiler(object):
       else:
         subgroup_key = subgroup.name
 
-      subgroup_task_spec.task_info.name = (
+      subgroup_task_name = (
           subgroup_task_spec.task_info.name or
           dsl_utils.sanitize_task_name(subgroup_key))
+      subgroup_task_spec.task_info.name = subgroup_task_name
       # human_name exists for ops only, and is used to de-dupe component spec.
       subgroup_component_name = (
           subgroup_task_spec.component_ref.name or
@@ -787,33 +862,26 @@ class Compiler(object):
               getattr(subgroup, 'human_name', subgroup_key)))
       subgroup_task_spec.component_ref.name = subgroup_component_name
 
-      if isinstance(subgroup, dsl.OpsGroup) and subgroup.type == 'graph':
+      if opsgroup_type == 'graph':
         raise NotImplementedError(
             'dsl.graph_component is not yet supported in KFP v2 compiler.')
 
-      if isinstance(subgroup, dsl.OpsGroup) and subgroup.type == 'exit_handler':
+      if opsgroup_type == 'exit_handler':
         raise NotImplementedError(
             'dsl.ExitHandler is not yet supported in KFP v2 compiler.')
 
-      if isinstance(subgroup, dsl.ContainerOp):
+      if is_container_op:
         if hasattr(subgroup, 'importer_spec'):
-          importer_task_name = subgroup.task_spec.task_info.name
-          importer_comp_name = subgroup.task_spec.component_ref.name
-          importer_exec_label = subgroup.component_spec.executor_label
-          group_component_spec.dag.tasks[importer_task_name].CopyFrom(
-              subgroup.task_spec)
-          pipeline_spec.components[importer_comp_name].CopyFrom(
-              subgroup.component_spec)
+          # Ops always carry their own specs, which were named above.
+          importer_exec_label = subgroup_component_spec.executor_label
+          group_component_spec.dag.tasks[subgroup_task_name].CopyFrom(
+              subgroup_task_spec)
+          pipeline_spec.components[subgroup_component_name].CopyFrom(
+              subgroup_component_spec)
           deployment_config.executors[importer_exec_label].importer.CopyFrom(
               subgroup.importer_spec)
 
       if is_loop_subgroup:
-        # Retrieve the real parent component, which is the compiler injected
-        # loop iterator component.
-        loop_iterator_component_name = dsl_utils.sanitize_component_name(
-            group.name + _LOOP_ITERATOR_COMPONENT_NAME_SUFFIX)
-        group_component_spec = pipeline_spec.components[
-            loop_iterator_component_name]
         self._update_loop_subgroup_specs(group, subgroup, group_component_spec,
                                          subgroup_component_spec,
                                          subgroup_task_spec)
@@ -821,22 +889,7 @@ class Compiler(object):
       subgroup_inputs = inputs.get(subgroup.name, [])
       subgroup_params = [param for param, _ in subgroup_inputs]
 
-      tasks_in_current_dag = [
-          dsl_utils.sanitize_task_name(subgroup.name) for subgroup in subgroups
-      ]
-
-      input_parameters_in_current_dag = [
-          input_name
-          for input_name in group_component_spec.input_definitions.parameters
-      ]
-      input_artifacts_in_current_dag = [
-          input_name
-          for input_name in group_component_spec.input_definitions.artifacts
-      ]
-
-      is_parent_component_root = group_component_spec == pipeline_spec.root
-
-      if isinstance(subgroup, dsl.ContainerOp):
+      if is_container_op:
 
         dsl_component_spec.update_task_inputs_spec(
             subgroup_task_spec,
@@ -847,7 +900,7 @@ class Compiler(object):
             input_artifacts_in_current_dag,
         )
 
-      if isinstance(subgroup, dsl.ParallelFor):
+      if opsgroup_type == dsl.ParallelFor.TYPE_NAME:
         if subgroup.parallelism is not None:
           warnings.warn(
               'Setting parallelism in ParallelFor is not supported yet.'
@@ -885,7 +938,7 @@ class Compiler(object):
                                              subgroup_component_spec,
                                              subgroup_task_spec, pipeline_spec)
 
-      if isinstance(subgroup, dsl.OpsGroup) and subgroup.type == 'condition':
+      if opsgroup_type == 'condition':
 
         # "punch the hole", adding inputs needed by its subgroup or tasks.
         dsl_component_spec.build_component_inputs_spec(
@@ -915,11 +968,11 @@ class Compiler(object):
                 condition=condition_string))
 
       # Generate dependencies section for this task.
-      if dependencies.get(subgroup.name, None):
-        group_dependencies = list(dependencies[subgroup.name])
-        group_dependencies.sort()
+      group_dependencies = dependencies.get(subgroup.name)
+      if group_dependencies:
         subgroup_task_spec.dependent_tasks.extend(
-            [dsl_utils.sanitize_task_name(dep) for dep in group_dependencies])
+            dsl_utils.sanitize_task_name(dep)
+            for dep in sorted(group_dependencies))
 
       # Add component spec if not exists
       if subgroup_component_name not in pipeline_spec.components:
@@ -927,13 +980,13 @@ class Compiler(object):
             subgroup_component_spec)
 
       # Add task spec
-      group_component_spec.dag.tasks[
-          subgroup_task_spec.task_info.name].CopyFrom(subgroup_task_spec)
+      group_component_spec.dag.tasks[subgroup_task_name].CopyFrom(
+          subgroup_task_spec)
 
+      executor_label = subgroup_component_spec.executor_label
       # Add AIPlatformCustomJobSpec, if applicable.
       custom_job_spec = getattr(subgroup, 'custom_job_spec', None)
       if custom_job_spec:
-        executor_label = subgroup_component_spec.executor_label
         if executor_label not in deployment_config.executors:
           deployment_config.executors[
               executor_label].custom_job.custom_job.update(custom_job_spec)
@@ -942,24 +995,13 @@ class Compiler(object):
       container_spec = getattr(subgroup, 'container_spec', None)
       # Ignore contaienr_spec if custom_job_spec exists.
       if container_spec and not custom_job_spec:
-        if compiler_utils.is_v2_component(subgroup):
-          compiler_utils.refactor_v2_container_spec(container_spec)
-        executor_label = subgroup_component_spec.executor_label
-
+        # Only the container spec copied into the executor needs refactoring.
         if executor_label not in deployment_config.executors:
+          if compiler_utils.is_v2_component(subgroup):
+            compiler_utils.refactor_v2_container_spec(container_spec)
           deployment_config.executors[executor_label].container.CopyFrom(
               container_spec)
 
-    pipeline_spec.deployment_spec.update(
-        json_format.MessageToDict(deployment_config))
-
-    # Surface metrics outputs to the top.
-    self._populate_metrics_in_dag_outputs(
-        group.ops,
-        op_to_parent_groups,
-        pipeline_spec,
-    )
-
   def _create_pipeline_spec(
       self,
       args: List[dsl.PipelineParam],
@@ -996,6 +1038,10 @@ class Compiler(object):
     opsgroups = self._get_groups(root_group)
     op_name_to_parent_groups = self._get_groups_for_ops(root_group)
     opgroup_name_to_parent_groups = self._get_groups_for_opsgroups(root_group)
+    name_to_parent_groups = self._get_name_to_groups(
+        op_name_to_parent_groups, opgroup_name_to_parent_groups)
+    # Shared by the inputs/outputs and dependencies passes of this pipeline.
+    common_ancestors_len_cache = {}
 
     condition_params = self._get_condition_params_for_ops(root_group)
     op_name_to_for_loop_op = self._get_for_loop_ops(root_group)
@@ -1005,14 +1051,16 @@ class Compiler(object):
         root_group,
         op_name_to_parent_groups,
         opgroup_name_to_parent_groups,
+        name_to_parent_groups,
+        common_ancestors_len_cache,
         condition_params,
         op_name_to_for_loop_op,
     )
     dependencies = self._get_dependencies(
         pipeline,
         root_group,
-        op_name_to_parent_groups,
-        opgroup_name_to_parent_groups,
+        name_to_parent_groups,
+        common_ancestors_len_cache,
         opsgroups,
         condition_params,
     )
@@ -1026,54 +1074,68 @@ class Compiler(object):
           pipeline_spec,
           deployment_config,
           root_group.name,
-          op_name_to_parent_groups,
       )
 
+    # Surface metrics outputs to the top.
+    self._populate_metrics_in_dag_outputs(
+        list(pipeline.ops.values()),
+        op_name_to_parent_groups,
+        pipeline_spec,
+    )
+
+    # Converted once all groups have registered their executors.
+    pipeline_spec.deployment_spec.update(
+        json_format.MessageToDict(deployment_config))
+
     return pipeline_spec
 
   # TODO: Sanitizing beforehand, so that we don't need to sanitize here.
   def _sanitize_and_inject_artifact(self, pipeline: dsl.Pipeline) -> None:
     """Sanitize operator/param names and inject pipeline artifact location. """
 
+    # The same names, e.g. op names referenced by every output, are sanitized
+    # over and over, memoize the results for this pipeline.
+    sanitize_name = functools.lru_cache(maxsize=None)(sanitize_k8s_name)
+
     # Sanitize operator names and param names
     sanitized_ops = {}
 
     for op in pipeline.ops.values():
-      sanitized_name = sanitize_k8s_name(op.name)
+      sanitized_name = sanitize_name(op.name)
       op.name = sanitized_name
       for param in op.outputs.values():
-        param.name = sanitize_k8s_name(param.name, True)
+        param.name = sanitize_name(param.name, True)
         if param.op_name:
-          param.op_name = sanitize_k8s_name(param.op_name)
+          param.op_name = sanitize_name(param.op_name)
       if op.output is not None and not isinstance(
           op.output, dsl._container_op._MultipleOutputsError):
-        op.output.name = sanitize_k8s_name(op.output.name, True)
-        op.output.op_name = sanitize_k8s_name(op.output.op_name)
+        op.output.name = sanitize_name(op.output.name, True)
+        op.output.op_name = sanitize_name(op.output.op_name)
       if op.dependent_names:
         op.dependent_names = [
-            sanitize_k8s_name(name) for name in op.dependent_names
+            sanitize_name(name) for name in op.dependent_names
         ]
       if isinstance(op, dsl.ContainerOp) and op.file_outputs is not None:
         sanitized_file_outputs = {}
         for key in op.file_outputs.keys():
-          sanitized_file_outputs[sanitize_k8s_name(key,
-                                                   True)] = op.file_outputs[key]
+          sanitized_file_outputs[sanitize_name(key,
+                                               True)] = op.file_outputs[key]
         op.file_outputs = sanitized_file_outputs
       elif isinstance(op, dsl.ResourceOp) and op.attribute_outputs is not None:
         sanitized_attribute_outputs = {}
         for key in op.attribute_outputs.keys():
-          sanitized_attribute_outputs[sanitize_k8s_name(key, True)] = \
+          sanitized_attribute_outputs[sanitize_name(key, True)] = \
             op.attribute_outputs[key]
         op.attribute_outputs = sanitized_attribute_outputs
       if isinstance(op, dsl.ContainerOp):
         if op.input_artifact_paths:
           op.input_artifact_paths = {
-              sanitize_k8s_name(key, True): value
+              sanitize_name(key, True): value
               for key, value in op.input_artifact_paths.items()
           }
         if op.artifact_arguments:
           op.artifact_arguments = {
-              sanitize_k8s_name(key, True): value
+              sanitize_name(key, True): value
               for key, value in op.artifact_arguments.items()
           }
       sanitized_ops[sanitized_name] = op
@@ -1086,7 +1148,8 @@ class Compiler(object):
       pipeline_func: Callable[..., Any],
       pipeline_name: Optional[str] = None,
       pipeline_parameters_override: Optional[Mapping[str, Any]] = None,
-  ) -> pipeline_spec_pb2.PipelineJob:
+  ) -> Tuple[pipeline_spec_pb2.PipelineSpec,
+             pipeline_spec_pb2.PipelineJob.RuntimeConfig]:
     """Creates a pipeline instance and constructs the pipeline spec from it.
 
     Args:
@@ -1096,7 +1159,9 @@ class Compiler(object):
         Optional.
 
     Returns:
-      A PipelineJob proto representing the compiled pipeline.
+      A tuple of the PipelineSpec proto representing the compiled pipeline and
+      the PipelineJob RuntimeConfig proto. They are kept apart so that writing
+      JSON does not need to copy the spec into the PipelineJob Struct first.
     """
 
     # Create the arg list with no default values and call pipeline function.
@@ -1110,17 +1175,17 @@ class Compiler(object):
       warnings.warn('pipeline_root is None or empty. A valid pipeline_root '
                     'must be provided at job submission.')
 
+    input_types = {
+        pipeline_input.name: pipeline_input.type
+        for pipeline_input in pipeline_meta.inputs or []
+    }
     args_list = []
     signature = inspect.signature(pipeline_func)
     for arg_name in signature.parameters:
-      arg_type = None
-      for pipeline_input in pipeline_meta.inputs or []:
-        if arg_name == pipeline_input.name:
-          arg_type = pipeline_input.type
-          break
       args_list.append(
           dsl.PipelineParam(
-              sanitize_k8s_name(arg_name, True), param_type=arg_type))
+              sanitize_k8s_name(arg_name, True),
+              param_type=input_types.get(arg_name)))
 
     with dsl.Pipeline(pipeline_name) as dsl_pipeline:
       pipeline_func(*args_list)
@@ -1160,10 +1225,8 @@ class Compiler(object):
 
     runtime_config = compiler_utils.build_runtime_config_spec(
         output_directory=pipeline_root, pipeline_parameters=pipeline_parameters)
-    pipeline_job = pipeline_spec_pb2.PipelineJob(runtime_config=runtime_config)
-    pipeline_job.pipeline_spec.update(json_format.MessageToDict(pipeline_spec))
 
-    return pipeline_job
+    return pipeline_spec, runtime_config
 
   def compile(self,
               pipeline_func: Callable[..., Any],
@@ -1176,7 +1239,8 @@ class Compiler(object):
     Args:
       pipeline_func: Pipeline function with @dsl.pipeline decorator.
       package_path: The output pipeline job .json file path. for example,
-        "~/pipeline_job.json"
+        "~/pipeline_job.json". A path ending with ".pb" or ".binpb" gets the
+        binary serialized PipelineJob proto instead.
       pipeline_name: The name of the pipeline. Optional.
       pipeline_parameters: The mapping from parameter names to values. Optional.
       type_check: Whether to enable the type check or not, default: True.
@@ -1184,31 +1248,51 @@ class Compiler(object):
     type_check_old_value = kfp.TYPE_CHECK
     try:
       kfp.TYPE_CHECK = type_check
-      pipeline_job = self._create_pipeline_v2(
+      pipeline_spec, runtime_config = self._create_pipeline_v2(
           pipeline_func=pipeline_func,
           pipeline_name=pipeline_name,
           pipeline_parameters_override=pipeline_parameters)
-      self._write_pipeline(pipeline_job, package_path)
+      self._write_pipeline(pipeline_spec, runtime_config, package_path)
     finally:
       kfp.TYPE_CHECK = type_check_old_value
 
-  def _write_pipeline(self, pipeline_job: pipeline_spec_pb2.PipelineJob,
-                      output_path: str) -> None:
-    """Dump pipeline spec into json file.
+  def _write_pipeline(
+      self,
+      pipeline_spec: pipeline_spec_pb2.PipelineSpec,
+      runtime_config: pipeline_spec_pb2.PipelineJob.RuntimeConfig,
+      output_path: str,
+  ) -> None:
+    """Dump pipeline job into json or binary protobuf file.
 
     Args:
-      pipeline_job: IR pipeline job spec.
-      ouput_path: The file path to be written.
+      pipeline_spec: IR pipeline spec.
+      runtime_config: The runtime config of the pipeline job.
+      ouput_path: The file path to be written. A path ending with ".pb" or
+        ".binpb" gets the serialized PipelineJob proto, which skips the JSON
+        conversion.
 
     Raises:
       ValueError: if the specified output path doesn't end with the acceptable
       extentions.
     """
-    json_text = json_format.MessageToJson(pipeline_job)
-
     if output_path.endswith('.json'):
+      # Parses to the same PipelineJob as json_format.MessageToJson would
+      # write, but keys follow proto field order rather than the Struct order.
+      pipeline_job_dict = {
+          'pipelineSpec': json_format.MessageToDict(pipeline_spec),
+          'runtimeConfig': json_format.MessageToDict(runtime_config),
+      }
+      json_text = json.dumps(pipeline_job_dict, indent=2)
       with open(output_path, 'w') as json_file:
         json_file.write(json_text)
+    elif output_path.endswith(('.pb', '.binpb')):
+      pipeline_job = pipeline_spec_pb2.PipelineJob(
+          runtime_config=runtime_config)
+      pipeline_job.pipeline_spec.update(
+          json_format.MessageToDict(pipeline_spec))
+      with open(output_path, 'wb') as pb_file:
+        pb_file.write(pipeline_job.SerializeToString())
     else:
       raise ValueError(
-          'The output path {} should ends with ".json".'.format(output_path))
+          'The output path {} should ends with ".json", ".pb" or ".binpb".'
+          .format(output_path))
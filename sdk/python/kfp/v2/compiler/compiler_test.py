@@ -21,6 +21,7 @@ import unittest
 from kfp.v2 import components
 from kfp.v2 import compiler
 from kfp.v2 import dsl
+from kfp.pipeline_spec import pipeline_spec_pb2
 
 
 class CompilerTest(unittest.TestCase):
@@ -74,6 +75,41 @@ class CompilerTest(unittest.TestCase):
     finally:
       shutil.rmtree(tmpdir)
 
+  def test_compile_pipeline_to_binary_proto(self):
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+
+      @dsl.pipeline(name='test-pipeline', pipeline_root='gs://path')
+      def my_pipeline(text: str = 'Hello KFP!'):
+        pass
+
+      target_pb_file = os.path.join(tmpdir, 'result.pb')
+      compiler.Compiler().compile(
+          pipeline_func=my_pipeline, package_path=target_pb_file)
+
+      with open(target_pb_file, 'rb') as f:
+        pipeline_job = pipeline_spec_pb2.PipelineJob.FromString(f.read())
+      self.assertEqual('gs://path',
+                       pipeline_job.runtime_config.gcs_output_directory)
+      self.assertEqual(
+          'test-pipeline',
+          pipeline_job.pipeline_spec['pipelineInfo']['name'])
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def test_compile_pipeline_with_unsupported_output_path_should_raise_error(
+      self):
+
+    @dsl.pipeline(name='test-pipeline', pipeline_root='gs://path')
+    def my_pipeline():
+      pass
+
+    with self.assertRaisesRegex(
+        ValueError, 'should ends with ".json", ".pb" or ".binpb"'):
+      compiler.Compiler().compile(
+          pipeline_func=my_pipeline, package_path='output.yaml')
+
   def test_compile_pipeline_with_dsl_exithandler_should_raise_error(self):
 
     gcs_download_op = components.load_component_from_text("""
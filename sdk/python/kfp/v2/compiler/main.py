@@ -43,7 +43,8 @@ def parse_arguments() -> argparse.Namespace:
       '--output',
       type=str,
       required=True,
-      help='local path to the output PipelineJob json file.')
+      help=('local path to the output PipelineJob json '
+            '(or binary .pb/.binpb) file.'))
   parser.add_argument(
       '--disable-type-check',
       action='store_true',
@@ -63,6 +63,9 @@ class CompilerCliTests(unittest.TestCase):
   def test_pipeline_with_importer(self):
     self._test_compile_py_to_json('pipeline_with_importer')
 
+  def test_pipeline_with_importer_in_loop(self):
+    self._test_compile_py_to_json('pipeline_with_importer_in_loop')
+
   def test_pipeline_with_ontology(self):
     self._test_compile_py_to_json('pipeline_with_ontology')
 
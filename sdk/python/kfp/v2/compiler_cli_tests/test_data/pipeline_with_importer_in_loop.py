@@ -0,0 +1,45 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Pipeline using dsl.importer as the first task of a dsl.ParallelFor."""
+
+from kfp import components
+from kfp import dsl
+from kfp.dsl.io_types import Dataset, InputArtifact
+from kfp.v2 import compiler
+
+
+def train(dataset: InputArtifact(Dataset)):
+  """Dummy Training step."""
+  with open(dataset.path, 'r') as f:
+    data = f.read()
+  print('Dataset:', data)
+
+
+train_op = components.create_component_from_func_v2(train)
+
+
+@dsl.pipeline(
+    name='pipeline-with-importer-in-loop', pipeline_root='dummy_root')
+def my_pipeline(
+    dataset: str = 'gs://ml-pipeline-playground/shakespeare1.txt'):
+
+  with dsl.ParallelFor(['1', '2']):
+    importer = dsl.importer(
+        artifact_uri=dataset, artifact_class=Dataset, reimport=False)
+    train_op(dataset=importer.output)
+
+
+if __name__ == '__main__':
+  compiler.Compiler().compile(
+      pipeline_func=my_pipeline, package_path=__file__.replace('.py', '.json'))